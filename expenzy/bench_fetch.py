@@ -0,0 +1,87 @@
+"""
+Benchmark of PayoutQuery.fetch latency with and without the
+expenzy_payout indexes from db_setup.py.
+
+For each table size a scratch copy of expenzy_payout is filled in a
+separate schema, so the real table is left alone. Usage:
+
+    python bench_fetch.py [size ...]
+
+BENCH_NOTIFYING_RATIO sets the share of payouts still in notifying state.
+"""
+
+import os
+import statistics
+import sys
+import time
+
+from database import DBConnection
+from db_setup import PAYOUT_INDEXES, PAYOUT_TABLE
+from models import PayoutQuery
+
+
+SCHEMA = "expenzy_bench"
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+NOTIFYING_RATIO = float(os.getenv("BENCH_NOTIFYING_RATIO", 0.01))
+PAGE_SIZE = 50
+REPEAT = 5
+
+QUERIES = {
+    "first page": lambda connection: PayoutQuery().fetch(connection, "notifying", limit=PAGE_SIZE),
+    "all notifying": lambda connection: PayoutQuery().fetch(connection, "notifying"),
+    "count processing": lambda connection: connection.fetch_one(
+        "SELECT COUNT(*) FROM expenzy_payout WHERE state = 'processing'"
+    ),
+}
+
+
+def populate(connection, size):
+    connection.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    connection.execute(f"CREATE SCHEMA {SCHEMA}")
+    connection.execute(f"SET search_path TO {SCHEMA}")
+    connection.execute(PAYOUT_TABLE)
+    connection.execute(
+        """
+        INSERT INTO expenzy_payout(id, create_time, amount, recipient_account_identifier, state)
+        SELECT gen_random_uuid(), NOW() - make_interval(secs => i), (random() * 100)::numeric(16, 2), '4321',
+               CASE WHEN random() < %s THEN 'notifying' ELSE 'processing' END
+          FROM generate_series(1, %s) AS i
+        """,
+        (NOTIFYING_RATIO, size),
+    )
+    connection.execute("ANALYZE expenzy_payout")
+
+
+def measure(connection):
+    """Median latency in milliseconds of each query."""
+    timings = {}
+    for name, query in QUERIES.items():
+        samples = []
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            query(connection)
+            samples.append((time.perf_counter() - start) * 1000)
+        timings[name] = statistics.median(samples)
+    return timings
+
+
+def main(sizes):
+    connection = DBConnection(hostname=os.environ.get("DB_HOSTNAME", "127.0.0.1"))
+    try:
+        print(f"{'rows':>10}  {'query':<18}{'no index ms':>14}{'indexed ms':>14}")
+        for size in sizes:
+            populate(connection, size)
+            before = measure(connection)
+            for index in PAYOUT_INDEXES:
+                connection.execute(index)
+            connection.execute("ANALYZE expenzy_payout")
+            after = measure(connection)
+            for name in QUERIES:
+                print(f"{size:>10}  {name:<18}{before[name]:>14.2f}{after[name]:>14.2f}")
+    finally:
+        connection.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        connection.close()
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
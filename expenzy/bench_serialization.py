@@ -0,0 +1,86 @@
+"""
+Benchmark of the payout list serialization, from database rows to JSON
+body, before and after serialization.py.
+
+    old: Payout dataclass per row, dataclasses.asdict, stdlib json encoder
+    new: slotted Payout per row, serialization.encode_payouts (orjson
+         when installed)
+
+Rows are generated in memory, no database needed. Usage:
+
+    python bench_serialization.py [size ...]
+"""
+
+import datetime
+import decimal
+import json
+import statistics
+import sys
+import time
+import uuid
+from dataclasses import asdict, dataclass
+
+from json_provider import default
+from models import Payout
+from serialization import encode_payouts
+
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+REPEAT = 5
+
+
+@dataclass
+class DictPayout:
+    """Payout as it was before, without slots"""
+
+    id: uuid.UUID
+    create_time: datetime.datetime
+    amount: decimal.Decimal
+    recipient_account_identifier: str
+    state: str
+
+
+def old_path(rows):
+    return json.dumps([asdict(DictPayout(*row)) for row in rows], default=default, separators=(",", ":"))
+
+
+def new_path(rows):
+    return encode_payouts([Payout(*row) for row in rows])
+
+
+PATHS = {"old": old_path, "new": new_path}
+
+
+def make_rows(size):
+    now = datetime.datetime.now()
+    return [
+        (uuid.uuid4(), now - datetime.timedelta(seconds=i), decimal.Decimal(i % 10000) / 100, "4321", "notifying")
+        for i in range(size)
+    ]
+
+
+def measure(rows):
+    """Median time in milliseconds of each path."""
+    timings = {}
+    for name, path in PATHS.items():
+        samples = []
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            path(rows)
+            samples.append((time.perf_counter() - start) * 1000)
+        timings[name] = statistics.median(samples)
+    return timings
+
+
+def main(sizes):
+    print(f"{'rows':>10}{'old ms':>12}{'new ms':>12}{'speedup':>10}")
+    for size in sizes:
+        rows = make_rows(size)
+        if json.loads(old_path(rows)) != json.loads(new_path(rows)):
+            raise AssertionError("old and new paths encode differently")
+        timings = measure(rows)
+        print(f"{size:>10}{timings['old']:>12.2f}{timings['new']:>12.2f}{timings['old'] / timings['new']:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """psycopg2 connection remembering when it was opened or last given back to the pool."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_used = time.monotonic()
+
+
+class BlockingConnectionPool:
+    """
+    Thread-safe connection pool for the gunicorn gthread workers.
+
+    psycopg2's ThreadedConnectionPool raises as soon as it is exhausted,
+    this one waits up to timeout seconds for a connection instead.
+    Connections idle for longer than HEALTH_CHECK_AFTER seconds are
+    checked with a SELECT 1 on checkout, broken ones are closed and the
+    next one is tried, down to a newly opened connection.
+    """
+
+    HEALTH_CHECK_AFTER = 30
+
+    def __init__(self, dsn, maxconn, timeout=30):
+        self.timeout = timeout
+        self._pool = psycopg2.pool.ThreadedConnectionPool(1, maxconn, dsn, connection_factory=PooledConnection)
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise psycopg2.pool.PoolError(f"No connection available within {self.timeout}s")
+        try:
+            connection = self._pool.getconn()
+            # each broken one is dropped, ends with a new connection at worst
+            while not self._is_healthy(connection):
+                self._pool.putconn(connection, close=True)
+                connection = self._pool.getconn()
+            return connection
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, connection):
+        try:
+            connection.last_used = time.monotonic()
+            # the pool rolls back unfinished transactions and drops closed
+            # or broken connections
+            self._pool.putconn(connection, close=bool(connection.closed))
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+    def _is_healthy(self, connection):
+        if connection.closed:
+            return False
+        if connection.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        # a newly opened connection is recent, so the loop in getconn ends
+        if time.monotonic() - connection.last_used < self.HEALTH_CHECK_AFTER:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_connection_pool():
+    """Get or create the process wide pool, sized by GUNICORN_THREADS."""
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                size = int(os.environ.get("GUNICORN_THREADS", 4))
+                dsn = psycopg2.extensions.make_dsn(
+                    host=os.environ.get("DB_HOSTNAME", "127.0.0.1"),
+                    port=5432,
+                    user="shared",
+                    password="shared",
+                    dbname="shared",
+                )
+                _pool = BlockingConnectionPool(dsn, maxconn=size)
+                print(f"[ConnectionPool] Created connection pool (max={size})")
+
+    return _pool
+
+
+def close_connection_pool():
+    """Close the connection pool on shutdown."""
+    global _pool
+    if _pool:
+        _pool.closeall()
+        _pool = None
@@ -4,12 +4,18 @@ import psycopg2
 import psycopg2.extras
 
 
+psycopg2.extras.register_uuid()
+
+
 @dataclass
 class DBConnection:
     """
     This class represents a database connection, and has some helper
     methods to work with the database. You can add more if you want to,
     or use something completely different, like an ORM or directly psycopg2.
+
+    When pool is given (see connection_pool.py), the connection is
+    borrowed from it and close() gives it back.
     """
 
     hostname: str = field(default="shared-db")
@@ -18,16 +24,24 @@ class DBConnection:
     password: str = field(default="shared")
     database: str = field(default="shared")
     autocommit: bool = field(default=True)
+    pool: object = field(default=None, repr=False)
 
     def __post_init__(self):
-        psycopg2.extras.register_uuid()
-        self.connection = psycopg2.connect(
-            f"postgres://{self.username}:{self.password}@{self.hostname}:{self.port}/{self.database}"
-        )
+        if self.pool is not None:
+            self.connection = self.pool.getconn()
+        else:
+            self.connection = psycopg2.connect(self.dsn)
         self.connection.autocommit = self.autocommit
 
+    @property
+    def dsn(self):
+        return f"postgres://{self.username}:{self.password}@{self.hostname}:{self.port}/{self.database}"
+
     def close(self):
-        self.connection.close()
+        if self.pool is not None:
+            self.pool.putconn(self.connection)
+        else:
+            self.connection.close()
 
     def begin_transaction(self):
         self.connection.autocommit = False
@@ -63,3 +77,31 @@ class DBConnection:
         """
         with self.connection.cursor() as cursor:
             cursor.execute(sql, params)
+
+    def execute_values(self, sql, argslist, page_size=100):
+        """
+        Execute a query with a single VALUES %s placeholder for all rows in
+        argslist, page_size rows per statement (see psycopg2.extras.execute_values).
+        """
+        with self.connection.cursor() as cursor:
+            psycopg2.extras.execute_values(cursor, sql, argslist, page_size=page_size)
+
+    def stream_results(self, sql, params=None, chunk_size=1000):
+        """
+        Run the given query on a server side (named) cursor, yielding its
+        rows in lists of at most chunk_size, so the whole result is never
+        held in memory. Named cursors only live in a transaction, one is
+        open while the rows are iterated.
+        """
+        self.begin_transaction()
+        try:
+            with self.connection.cursor(name="stream_results") as cursor:
+                cursor.itersize = chunk_size
+                cursor.execute(sql, params)
+                while rows := cursor.fetchmany(chunk_size):
+                    yield rows
+            self.commit_transaction()
+        except BaseException:
+            # also when the consumer stops early (GeneratorExit)
+            self.rollback_transaction()
+            raise
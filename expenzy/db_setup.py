@@ -8,23 +8,95 @@ from database import DBConnection
 # alter user expenzy password 'expenzy';
 # create database expenzy owner expenzy;
 
-connection = DBConnection(hostname=os.environ.get("DB_HOSTNAME", "127.0.0.1"))
-connection.begin_transaction()
-if os.getenv("RESET_DB"):
-    connection.execute("drop table if exists expenzy_payout")
-
-connection.execute(
-    """
+PAYOUT_TABLE = """
 create table if not exists expenzy_payout(
     id uuid primary key,
     create_time timestamptz not null,
     amount numeric(16, 2) not null,
     recipient_account_identifier varchar(20) not null,
     state varchar(10) not null,
-    state_update_count integer not null default 0
+    state_update_count integer not null default 0,
+    -- id of the last transaction inserting or updating the payout, for
+    -- the change feed (PayoutQuery.fetch_changes)
+    change_xid xid8 not null default pg_current_xact_id()
 );
 """
-)
 
-connection.commit_transaction()
-connection.close()
+# Tables created before the change feed
+PAYOUT_MIGRATIONS = [
+    """
+alter table expenzy_payout
+    add column if not exists change_xid xid8 not null default pg_current_xact_id();
+""",
+]
+
+PAYOUT_INDEXES = [
+    # Partners poll for notifying payouts, newest first: keep those in a
+    # small partial index matching PayoutQuery.fetch ordering.
+    """
+create index if not exists expenzy_payout_notifying_idx
+    on expenzy_payout (create_time desc, id desc)
+ where state = 'notifying';
+""",
+    # Change feed of notifying payouts.
+    """
+create index if not exists expenzy_payout_notifying_changes_idx
+    on expenzy_payout (change_xid, id)
+ where state = 'notifying';
+""",
+    # Any other state filter, and counting by state.
+    """
+create index if not exists expenzy_payout_state_idx
+    on expenzy_payout (state, create_time desc, id desc);
+""",
+]
+
+
+# Counters kept up to date by PayoutQuery, for the cached mode of the
+# count endpoint. Each name is spread over shards to avoid every write
+# contending for a single row, see PayoutQuery.COUNTER_SHARDS.
+COUNTER_TABLE = """
+create table if not exists expenzy_payout_counter(
+    name varchar(50) not null,
+    shard smallint not null,
+    value bigint not null default 0,
+    primary key (name, shard)
+);
+"""
+
+# Initial counter values for payouts existing before the counters
+COUNTER_BACKFILL = """
+insert into expenzy_payout_counter (name, shard, value)
+select 'state:' || state, 0, count(*)
+  from expenzy_payout
+ where not exists (select 1 from expenzy_payout_counter)
+ group by state
+ union all
+select 'max_update_count:' || state, 0, max(state_update_count)
+  from expenzy_payout
+ where not exists (select 1 from expenzy_payout_counter)
+ group by state;
+"""
+
+
+def main():
+    connection = DBConnection(hostname=os.environ.get("DB_HOSTNAME", "127.0.0.1"))
+    connection.begin_transaction()
+    if os.getenv("RESET_DB"):
+        connection.execute("drop table if exists expenzy_payout")
+        connection.execute("drop table if exists expenzy_payout_counter")
+
+    connection.execute(PAYOUT_TABLE)
+    for migration in PAYOUT_MIGRATIONS:
+        connection.execute(migration)
+    for index in PAYOUT_INDEXES:
+        connection.execute(index)
+    connection.execute(COUNTER_TABLE)
+    connection.execute(COUNTER_BACKFILL)
+
+    connection.commit_transaction()
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,12 @@
 from datetime import datetime
+import base64
 import random
 import decimal
 from dataclasses import dataclass, field
 import uuid
 
 
-@dataclass
+@dataclass(slots=True)
 class Payout:
     id: uuid.UUID = field(default_factory=uuid.uuid4)
     create_time: datetime = field(default_factory=datetime.now)
@@ -16,46 +17,199 @@ class Payout:
     # exercise no need to add more fields
 
 
+def encode_cursor(*values):
+    """Opaque keyset cursor made of the given key values."""
+    raw = "|".join(str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor, *types):
+    """Returns the key values of a cursor converted with types, raises ValueError if invalid."""
+    try:
+        values = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        if len(values) != len(types):
+            raise ValueError("Wrong number of values")
+        return tuple(type_(value) for type_, value in zip(types, values))
+    except (TypeError, UnicodeError, ValueError) as exc:
+        raise ValueError(f"Invalid cursor {cursor!r}") from exc
+
+
+def page_cursor(payout):
+    """Cursor continuing PayoutQuery.fetch after the given payout."""
+    return encode_cursor(payout.create_time.isoformat(), payout.id)
+
+
 class PayoutQuery:
+    # Rows per counter in expenzy_payout_counter, writers pick one at random
+    COUNTER_SHARDS = 16
+
     def insert(self, connection, payout):
-        connection.execute(
-            "INSERT INTO expenzy_payout(id, create_time, amount, recipient_account_identifier, state) "
-            "     VALUES (%s, %s, %s, %s, %s)",
-            (
-                payout.id,
-                payout.create_time,
-                payout.amount,
-                payout.recipient_account_identifier,
-                payout.state,
-            ),
-        )
+        self.insert_many(connection, [payout])
         return payout
 
-    def fetch(self, connection, state):
-        if state:
-            results = connection.fetch_results(
-                """
-                SELECT id, create_time, amount, recipient_account_identifier, state
-                  FROM expenzy_payout
-                 WHERE state = %s ORDER BY create_time DESC
-            """,
-                (state,),
-            )
-        else:
-            results = connection.fetch_results(
-                """
-                SELECT id, create_time, amount, recipient_account_identifier, state
-                  FROM expenzy_payout ORDER BY create_time DESC
-            """
+    def insert_many(self, connection, payouts):
+        """Insert all given payouts with a single multi-row INSERT, returns them."""
+        if not payouts:
+            return payouts
+        # execute_values only fills the VALUES list, shard is a plain int
+        connection.execute_values(
+            f"""
+            WITH inserted AS (
+                INSERT INTO expenzy_payout(id, create_time, amount, recipient_account_identifier, state)
+                     VALUES %s
+                  RETURNING state
             )
+            INSERT INTO expenzy_payout_counter (name, shard, value)
+            SELECT 'state:' || state, {random.randrange(self.COUNTER_SHARDS)}, count(*) FROM inserted GROUP BY state
+                ON CONFLICT (name, shard) DO UPDATE SET value = expenzy_payout_counter.value + EXCLUDED.value
+        """,
+            [
+                (payout.id, payout.create_time, payout.amount, payout.recipient_account_identifier, payout.state)
+                for payout in payouts
+            ],
+            page_size=len(payouts),
+        )
+        return payouts
+
+    def fetch(self, connection, state, limit=None, cursor=None):
+        """
+        Payouts newest first. With limit, returns at most limit payouts
+        starting after the keyset cursor (see page_cursor).
+        """
+        sql, params = self._fetch_sql(state, limit, cursor)
+        results = connection.fetch_results(sql, params)
         return [Payout(*row) for row in results]
 
+    def stream(self, connection, state, cursor=None, chunk_size=1000):
+        """
+        Same as fetch without limit, read from a server side cursor:
+        returns an iterator of lists of at most chunk_size payouts.
+        Raises ValueError right away if the cursor is invalid.
+        """
+        sql, params = self._fetch_sql(state, None, cursor)
+        return (
+            [Payout(*row) for row in rows]
+            for rows in connection.stream_results(sql, params, chunk_size=chunk_size)
+        )
+
+    def _fetch_sql(self, state, limit, cursor):
+        conditions = []
+        params = []
+        if state:
+            conditions.append("state = %s")
+            params.append(state)
+        if cursor:
+            conditions.append("(create_time, id) < (%s, %s)")
+            params.extend(decode_cursor(cursor, datetime.fromisoformat, uuid.UUID))
+
+        sql = "SELECT id, create_time, amount, recipient_account_identifier, state FROM expenzy_payout"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY create_time DESC, id DESC"
+        if limit:
+            sql += " LIMIT %s"
+            params.append(limit)
+        return sql, params
+
+    def fetch_changes(self, connection, since, state=None, limit=1000):
+        """
+        Change feed: payouts inserted or updated after the since cursor,
+        oldest change first. Returns (payouts, next since cursor).
+
+        Changes are ordered by the id of the transaction making them, and
+        only changes older than every transaction still in flight are
+        returned, so a later call with the returned cursor never skips a
+        change that committed late. since "0" starts from the beginning.
+        """
+        if since == "0":
+            since_xid, since_id = 0, uuid.UUID(int=0)
+        else:
+            since_xid, since_id = decode_cursor(since, int, uuid.UUID)
+
+        # every transaction older than the horizon has finished
+        (horizon,) = connection.fetch_one("SELECT pg_snapshot_xmin(pg_current_snapshot())::text")
+
+        sql = """
+            SELECT id, create_time, amount, recipient_account_identifier, state, change_xid::text
+              FROM expenzy_payout
+             WHERE (change_xid, id) > (%s::text::xid8, %s)
+               AND change_xid < %s::text::xid8
+        """
+        params = [str(since_xid), since_id, horizon]
+        if state:
+            sql += " AND state = %s"
+            params.append(state)
+        sql += " ORDER BY change_xid, id LIMIT %s"
+        params.append(limit)
+
+        results = connection.fetch_results(sql, params)
+        payouts = [Payout(*row[:-1]) for row in results]
+        if len(results) == limit:
+            next_since = encode_cursor(results[-1][-1], results[-1][0])
+        else:
+            # nothing left below the horizon, continue from there
+            next_since = encode_cursor(horizon, uuid.UUID(int=0))
+        return payouts, next_since
+
     def update_state_by_id(self, connection, state, id):
+        return self.update_state_by_ids(connection, state, [id])
+
+    def update_state_by_ids(self, connection, state, ids):
+        """Update state of all given payouts at once, returns the updated payouts."""
         results = connection.fetch_results(
             """
-            UPDATE expenzy_payout set state = %s, state_update_count = state_update_count + 1
-             WHERE id = %s RETURNING id, create_time, amount, recipient_account_identifier, state
+            WITH previous AS (
+                SELECT id, state FROM expenzy_payout WHERE id = ANY(%(ids)s) ORDER BY id FOR UPDATE
+            ), updated AS (
+                UPDATE expenzy_payout p set state = %(state)s, state_update_count = p.state_update_count + 1,
+                       change_xid = pg_current_xact_id()
+                  FROM previous
+                 WHERE p.id = previous.id
+             RETURNING p.id, p.create_time, p.amount, p.recipient_account_identifier, p.state,
+                       p.state_update_count, previous.state AS previous_state
+            ), state_counts AS (
+                INSERT INTO expenzy_payout_counter (name, shard, value)
+                SELECT name, %(shard)s, sum(delta) FROM (
+                    SELECT 'state:' || previous_state AS name, -1 AS delta FROM updated WHERE previous_state <> state
+                     UNION ALL
+                    SELECT 'state:' || state, 1 FROM updated WHERE previous_state <> state
+                ) AS deltas GROUP BY name
+                    ON CONFLICT (name, shard) DO UPDATE SET value = expenzy_payout_counter.value + EXCLUDED.value
+            ), max_counts AS (
+                INSERT INTO expenzy_payout_counter (name, shard, value)
+                SELECT 'max_update_count:' || state, %(shard)s, max(state_update_count) FROM updated GROUP BY state
+                    ON CONFLICT (name, shard) DO UPDATE
+                   SET value = GREATEST(expenzy_payout_counter.value, EXCLUDED.value)
+            )
+            SELECT id, create_time, amount, recipient_account_identifier, state FROM updated
         """,
-            (state, id),
+            {"state": state, "ids": list(ids), "shard": random.randrange(self.COUNTER_SHARDS)},
         )
         return [Payout(*row) for row in results]
+
+    def count(self, connection):
+        """Returns (total, processing, max update count of processing) with a single scan."""
+        return connection.fetch_one(
+            """
+            SELECT COUNT(*),
+                   COUNT(*) FILTER (WHERE state = 'processing'),
+                   MAX(state_update_count) FILTER (WHERE state = 'processing')
+              FROM expenzy_payout
+        """
+        )
+
+    def count_cached(self, connection):
+        """
+        Same as count, read from expenzy_payout_counter so the cost does not
+        grow with the number of payouts. The max update count is
+        approximate: it is the highest count any payout reached while
+        processing, and does not drop when a payout leaves that state.
+        """
+        return connection.fetch_one(
+            """
+            SELECT COALESCE(SUM(value) FILTER (WHERE name LIKE 'state:%'), 0),
+                   COALESCE(SUM(value) FILTER (WHERE name = 'state:processing'), 0),
+                   MAX(value) FILTER (WHERE name = 'max_update_count:processing')
+              FROM expenzy_payout_counter
+        """
+        )
@@ -6,54 +6,53 @@ As a bonus exercise you might want to spot cases violating best
 practices in this script.
 """
 
-from multiprocessing.pool import ThreadPool
 import os
-import requests
 import traceback
 from time import sleep
 from urllib.parse import urljoin
 from models import Payout, PayoutQuery
 from database import DBConnection
+from webhook_sender import WebhookSender
 
 
 HOLVI_API_BASE_URL = os.environ.get("HOLVI_API_BASE_URL", "http://127.0.0.1:5002")
 
 
-def notify_partner():
-    try:
-        response = requests.get(urljoin(HOLVI_API_BASE_URL, "expenzy/webhook/"))
-        response.raise_for_status()
-    except Exception as exc:
-        traceback.print_exception(exc)
-
-
-def generate_new_payout(connection):
-    payout = Payout()
-    PayoutQuery().insert(connection, payout)
-    return payout
+def generate_new_payouts(connection, count):
+    return PayoutQuery().insert_many(connection, [Payout() for _ in range(count)])
 
 
 def main_loop():
-    # The notifications are sent asynchronously and concurrently
-    pool = ThreadPool(processes=int(os.getenv("CONCURRENCY", 2)))
+    # With BATCH_SIZE > 1, each attempt inserts that many payouts in one
+    # statement and transaction, then sends a webhook per payout.
+    # GENERATION_ATTEMPTS stays the number of payouts to generate.
+    batch_size = int(os.getenv("BATCH_SIZE", 1))
+    if batch_size < 1:
+        raise SystemExit(f"BATCH_SIZE must be at least 1, got {batch_size}")
+    # The notifications are sent asynchronously, at most CONCURRENCY at a
+    # time over reused connections
+    sender = WebhookSender(urljoin(HOLVI_API_BASE_URL, "expenzy/webhook/"), int(os.getenv("CONCURRENCY", 2)))
     connection = DBConnection(hostname=os.environ.get("DB_HOSTNAME", "127.0.0.1"))
+    generation_attempts = int(os.getenv("GENERATION_ATTEMPTS", 10))
     num_attempts = 0
     while True:
+        count = min(batch_size, generation_attempts - num_attempts)
         try:
             connection.begin_transaction()
-            generate_new_payout(connection)
+            generate_new_payouts(connection, count)
             connection.commit_transaction()
-            pool.apply_async(notify_partner)
+            for _ in range(count):
+                sender.send()
         except Exception as exc:
             traceback.print_exception(exc)
-        num_attempts += 1
-        if num_attempts == int(os.getenv("GENERATION_ATTEMPTS", 10)):
+            connection.rollback_transaction()
+        num_attempts += count
+        if num_attempts >= generation_attempts:
             print("Done generation, bye!")
             break
         sleep(float(os.getenv("SLEEP_BETWEEN_PAYOUT", 0.1)))
     connection.close()
-    pool.close()
-    pool.join()
+    sender.close()
 
 
 if __name__ == "__main__":
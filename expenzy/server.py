@@ -1,27 +1,100 @@
 from flask import Flask, request, jsonify
 from database import DBConnection
-from models import PayoutQuery
-from dataclasses import asdict
+from connection_pool import get_connection_pool
+from json_provider import FastJSONProvider
+from models import PayoutQuery, page_cursor
+from serialization import encode_payouts
+from uuid import UUID
 import os
 import random
 
 
 DB_HOSTNAME = hostname = os.environ.get("DB_HOSTNAME", "127.0.0.1")
 
+MAX_PAGE_SIZE = 1000
+MAX_BULK_SIZE = 1000
+# Payouts per fetch from the server side cursor when streaming a full list
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", 1000))
+
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
+
+
+def json_response(body):
+    """Response for an already encoded JSON body."""
+    return app.response_class(body, mimetype="application/json")
+
+
+def connect():
+    """Database connection borrowed from the process wide pool, close() returns it."""
+    return DBConnection(DB_HOSTNAME, pool=get_connection_pool())
 
 
 @app.route("/api/transaction/", methods=["POST"])
 def transaction_list():
-    connection = DBConnection(DB_HOSTNAME)
+    state = request.args.get("state")
+    # Optional pagination: with limit, X-Next-Cursor header is set when
+    # there may be more results, pass it back as cursor for the next page.
+    limit = request.args.get("limit", type=int)
+    cursor = request.args.get("cursor")
+    # Optional change feed: with since, only payouts changed after it are
+    # returned, and X-Next-Since header is the value for the next call.
+    since = request.args.get("since")
+    # get() turns an invalid limit into None, which would stream everything
+    if limit is None and "limit" in request.args:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit is not None and not 0 < limit <= MAX_PAGE_SIZE:
+        return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
+    if limit is None and since is None:
+        return stream_transaction_list(state, cursor)
+    connection = connect()
     try:
-        state = request.args.get("state")
-        payouts = PayoutQuery().fetch(connection, state)
-        return jsonify([asdict(p) for p in payouts])
+        try:
+            if since is not None:
+                payouts, next_since = PayoutQuery().fetch_changes(
+                    connection, since, state=state, limit=limit or MAX_PAGE_SIZE
+                )
+            else:
+                payouts = PayoutQuery().fetch(connection, state, limit=limit, cursor=cursor)
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+        response = json_response(encode_payouts(payouts))
+        if since is not None:
+            response.headers["X-Next-Since"] = next_since
+        elif limit and len(payouts) == limit:
+            response.headers["X-Next-Cursor"] = page_cursor(payouts[-1])
+        return response
     finally:
         connection.close()
 
 
+def stream_transaction_list(state, cursor):
+    """
+    Unpaginated list, streamed as a JSON array STREAM_CHUNK_SIZE payouts
+    at a time, so memory does not grow with the number of payouts.
+    """
+    connection = connect()
+    try:
+        chunks = PayoutQuery().stream(connection, state, cursor=cursor, chunk_size=STREAM_CHUNK_SIZE)
+    except ValueError as exc:
+        connection.close()
+        return jsonify({"error": str(exc)}), 400
+
+    def generate():
+        yield "["
+        separator = ""
+        for payouts in chunks:
+            # each chunk's array without its brackets
+            yield separator + encode_payouts(payouts)[1:-1]
+            separator = ","
+        yield "]"
+
+    response = json_response(generate())
+    # runs once the response is sent or aborted, even if never iterated
+    response.call_on_close(connection.close)
+    return response
+
+
 @app.route("/api/transaction/<uuid:uuid>/", methods=["POST"])
 def transaction_update(uuid):
     if random.random() < float(os.getenv("EXPENZY_FAILURE_RATE", 0.05)):
@@ -29,24 +102,60 @@ def transaction_update(uuid):
     state = request.form.get("state")
     if state not in ("processing", "error"):
         return jsonify({"error": f"State {state} not in processing, error"}), 404
-    connection = DBConnection(DB_HOSTNAME)
+    connection = connect()
     try:
         payouts = PayoutQuery().update_state_by_id(connection, state, uuid)
-        return jsonify([asdict(p) for p in payouts])
+        return json_response(encode_payouts(payouts))
+    finally:
+        connection.close()
+
+
+@app.route("/api/transaction/bulk/", methods=["POST"])
+def transaction_bulk_update():
+    """
+    Update state of many transactions in one call. Takes a JSON body
+    {"ids": [...], "state": ...} and returns [{"id": ..., "updated": bool}]
+    in the order of ids.
+    """
+    if random.random() < float(os.getenv("EXPENZY_FAILURE_RATE", 0.05)):
+        raise Exception("This API sometimes fails")
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    state = data.get("state")
+    if state not in ("processing", "error"):
+        return jsonify({"error": f"State {state} not in processing, error"}), 400
+    ids = data.get("ids", [])
+    if not isinstance(ids, list) or not all(isinstance(id, str) for id in ids):
+        return jsonify({"error": "ids must be a list of uuids"}), 400
+    try:
+        ids = [UUID(id) for id in ids]
+    except ValueError:
+        return jsonify({"error": "ids must be a list of uuids"}), 400
+    if len(ids) > MAX_BULK_SIZE:
+        return jsonify({"error": f"At most {MAX_BULK_SIZE} ids per call"}), 400
+    connection = connect()
+    try:
+        payouts = PayoutQuery().update_state_by_ids(connection, state, ids)
+        updated = {p.id for p in payouts}
+        return jsonify([{"id": id, "updated": id in updated} for id in ids])
     finally:
         connection.close()
 
 
 @app.route("/api/transaction/count", methods=["GET"])
 def transaction_count():
-    connection = DBConnection(DB_HOSTNAME)
-    (total_num_transactions,) = connection.fetch_one("SELECT COUNT(*) FROM expenzy_payout")
-    (processing_num_transactions,) = connection.fetch_one(
-        "SELECT COUNT(*) FROM expenzy_payout WHERE state = 'processing'"
-    )
-    (max_update_count,) = connection.fetch_one(
-        "SELECT max(state_update_count) FROM expenzy_payout WHERE state = 'processing'"
-    )
+    # mode=cached reads maintained counters instead of scanning the table
+    cached = request.args.get("mode") == "cached"
+    connection = connect()
+    try:
+        if cached:
+            counts = PayoutQuery().count_cached(connection)
+        else:
+            counts = PayoutQuery().count(connection)
+    finally:
+        connection.close()
+    (total_num_transactions, processing_num_transactions, max_update_count) = counts
     return jsonify(
         {
             "total_num_transactions": total_num_transactions,
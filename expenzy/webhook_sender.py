@@ -0,0 +1,84 @@
+import asyncio
+import threading
+import time
+import traceback
+
+import httpx
+
+
+class WebhookSender:
+    """
+    Sends webhooks from an asyncio event loop running in a background
+    thread, so the producer loop only schedules them.
+
+    At most concurrency webhooks are in flight, over keep-alive
+    connections of a single httpx.AsyncClient. The latency of each
+    webhook is recorded, close() waits for the pending ones and prints
+    a summary.
+    """
+
+    TIMEOUT = 10
+
+    def __init__(self, url, concurrency):
+        self.url = url
+        self.concurrency = concurrency
+        self.latencies = []
+        self.errors = 0
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="WebhookSender", daemon=True)
+        self._thread.start()
+        self._client, self._semaphore = self._call(self._setup())
+
+    def send(self):
+        """Schedule a webhook, returns without waiting for it."""
+        asyncio.run_coroutine_threadsafe(self._send(), self._loop)
+
+    def close(self):
+        """Wait for all scheduled webhooks, then stop the event loop."""
+        self._call(self._drain())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self.print_summary()
+
+    def print_summary(self):
+        if not self.latencies:
+            print(f"Sent no webhooks, {self.errors} failed")
+            return
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000
+
+        print(
+            f"Sent {len(latencies)} webhooks, {self.errors} failed, latency ms: "
+            f"p50 {percentile(50):.1f}, p95 {percentile(95):.1f}, "
+            f"p99 {percentile(99):.1f}, max {latencies[-1] * 1000:.1f}"
+        )
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _setup(self):
+        client = httpx.AsyncClient(
+            timeout=self.TIMEOUT,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+        )
+        return client, asyncio.Semaphore(self.concurrency)
+
+    async def _drain(self):
+        # sends scheduled before this call already have their task
+        await asyncio.gather(*(asyncio.all_tasks() - {asyncio.current_task()}))
+        await self._client.aclose()
+
+    async def _send(self):
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                response = await self._client.get(self.url)
+                response.raise_for_status()
+            except Exception as exc:
+                self.errors += 1
+                traceback.print_exception(exc)
+                return
+            self.latencies.append(time.perf_counter() - start)
@@ -0,0 +1,84 @@
+import collections
+import threading
+import time
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker.
+
+    Closed: calls go through, their outcome is recorded in a window of the
+    last WINDOW calls. Once at least MIN_CALLS are recorded and the share
+    of failures reaches FAILURE_RATE, the breaker opens.
+    Open: calls are refused for COOLDOWN seconds.
+    Half-open: after the cooldown, HALF_OPEN_CALLS probe calls go through.
+    A successful probe closes the breaker, a failed one opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_rate=0.5, window=20, min_calls=10, cooldown=10, half_open_calls=1):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.half_open_calls = half_open_calls
+        self._outcomes = collections.deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def allow_request(self):
+        """Returns True if a call may be made now."""
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probes = 0
+                print(f"[CircuitBreaker] {self.name} half-open")
+            if self._state == self.HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    return False
+                self._probes += 1
+            return True
+
+    def retry_after(self):
+        """Seconds until an open breaker lets probe calls through."""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0
+            return max(0, self.cooldown - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._state = self.CLOSED
+                self._outcomes.clear()
+                print(f"[CircuitBreaker] {self.name} closed")
+            elif self._state == self.CLOSED:
+                self._outcomes.append(True)
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._open()
+            elif self._state == self.CLOSED:
+                self._outcomes.append(False)
+                failures = self._outcomes.count(False)
+                if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                    self._open()
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        print(f"[CircuitBreaker] {self.name} open for {self.cooldown}s")
@@ -0,0 +1,77 @@
+import threading
+import time
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Thread-safe AIMD limit on in-flight calls.
+
+    Each call blocks in acquire() while `limit` calls are in flight, and
+    reports its latency and outcome to release(). Latency is smoothed
+    twice: a short-term average following the last few calls and a
+    long-term one following the last hundreds. The limit grows by one per
+    `limit` successful calls (about one per round trip), and shrinks by
+    BACKOFF_RATIO on a failure or when the short-term latency goes over
+    TOLERANCE times the long-term one, i.e. once the remote starts
+    queueing. At most one decrease per round trip, so a burst of slow
+    calls counts once.
+
+    Calls carrying several items (e.g. bulk requests) report their size.
+    A call of 100 items is slower than one of 2 even when the remote is
+    healthy, so averages are kept per power of two of size and a call is
+    only compared with calls of similar size.
+    """
+
+    BACKOFF_RATIO = 0.9
+    TOLERANCE = 2.0
+    # weight of the newest latency in the short and long-term averages
+    SHORT_WEIGHT = 0.2
+    LONG_WEIGHT = 0.01
+
+    def __init__(self, initial_limit, min_limit=1, max_limit=50):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        # size bucket -> [short-term, long-term] average latency
+        self._latencies = {}
+        self._last_decrease = 0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        with self._condition:
+            return int(self._limit)
+
+    @property
+    def in_flight(self):
+        with self._condition:
+            return self._in_flight
+
+    def acquire(self):
+        """Block until a call may start. Returns its start time for release()."""
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+        return time.monotonic()
+
+    def release(self, started_at, succeeded, size=1):
+        """Record the outcome of a call of size items started with acquire()."""
+        now = time.monotonic()
+        latency = now - started_at
+        with self._condition:
+            self._in_flight -= 1
+            averages = self._latencies.setdefault(max(size, 1).bit_length(), [latency, latency])
+            averages[0] += (latency - averages[0]) * self.SHORT_WEIGHT
+            averages[1] += (latency - averages[1]) * self.LONG_WEIGHT
+            short_term, long_term = averages
+
+            if not succeeded or short_term > long_term * self.TOLERANCE:
+                # calls started before the last decrease saw the old limit
+                if started_at >= self._last_decrease:
+                    self._limit = max(self.min_limit, self._limit * self.BACKOFF_RATIO)
+                    self._last_decrease = now
+            else:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._condition.notify_all()
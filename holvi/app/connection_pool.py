@@ -1,8 +1,22 @@
-from psycopg_pool import ConnectionPool
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
 import os
 
 # Global pool for connection a.k.a GCP
 _pool = None
+# Async counterpart for the ASGI holvi-api, bound to its event loop
+_async_pool = None
+# Max connections of each pool, i.e. per process
+POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 20))
+
+def get_conninfo():
+    """libpq connection string built from the DB_* environment variables"""
+    return (
+        f"host={os.environ.get('DB_HOSTNAME', '127.0.0.1')} "
+        f"port={os.environ.get('DB_PORT', '5432')} "
+        f"dbname={os.environ.get('DB_DATABASE', 'shared')} "
+        f"user={os.environ.get('DB_USERNAME', 'shared')} "
+        f"password={os.environ.get('DB_PASSWORD', 'shared')}"
+    )
 
 def get_connection_pool():
     """
@@ -12,22 +26,14 @@ def get_connection_pool():
     global _pool
     
     if _pool is None:
-        conninfo = (
-            f"host={os.environ.get('DB_HOSTNAME', '127.0.0.1')} "
-            f"port={os.environ.get('DB_PORT', '5432')} "
-            f"dbname={os.environ.get('DB_DATABASE', 'shared')} "
-            f"user={os.environ.get('DB_USERNAME', 'shared')} "
-            f"password={os.environ.get('DB_PASSWORD', 'shared')}"
-        )
-        
         # create pool
         _pool = ConnectionPool(
-            conninfo=conninfo,
+            conninfo=get_conninfo(),
             min_size=2,
-            max_size=20,
+            max_size=POOL_MAX_SIZE,
             timeout=30
         )
-        print("[ConnectionPool] Created connection pool (min=2, max=20)")
+        print(f"[ConnectionPool] Created connection pool (min=2, max={POOL_MAX_SIZE})")
     
     return _pool
 
@@ -37,4 +43,48 @@ def close_connection_pool():
     if _pool:
         _pool.close()
         _pool = None
-        print("[ConnectionPool] Closed connection pool")
\ No newline at end of file
+        print("[ConnectionPool] Closed connection pool")
+
+async def open_async_connection_pool():
+    """
+    Create and open the async pool, call once the event loop is running
+    (holvi-api opens it before serving)
+    """
+    global _async_pool
+
+    if _async_pool is None:
+        _async_pool = AsyncConnectionPool(
+            conninfo=get_conninfo(),
+            min_size=2,
+            max_size=POOL_MAX_SIZE,
+            timeout=30,
+            open=False,
+        )
+        await _async_pool.open()
+        print(f"[ConnectionPool] Created async connection pool (min=2, max={POOL_MAX_SIZE})")
+
+    return _async_pool
+
+def get_async_connection_pool():
+    """Get the async pool opened by open_async_connection_pool"""
+    if _async_pool is None:
+        raise RuntimeError("Async connection pool is not open")
+    return _async_pool
+
+async def close_async_connection_pool():
+    """Close the async connection pool on shutdown."""
+    global _async_pool
+    if _async_pool:
+        await _async_pool.close()
+        _async_pool = None
+        print("[ConnectionPool] Closed async connection pool")
+
+def reset_connection_pools():
+    """
+    Forget pools inherited from a parent process, call in a forked child
+    (gunicorn post_fork). Their connections belong to the parent, so they
+    are dropped without closing and the child creates its own pools.
+    """
+    global _pool, _async_pool
+    _pool = None
+    _async_pool = None
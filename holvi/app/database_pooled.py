@@ -1,4 +1,4 @@
-from connection_pool import get_connection_pool
+from connection_pool import get_async_connection_pool, get_connection_pool
 
 class PooledDBConnection:
     """
@@ -40,4 +40,48 @@ class PooledDBConnection:
     
     def rollback(self):
         if self.connection:
-            self.connection.rollback()
\ No newline at end of file
+            self.connection.rollback()
+
+
+class AsyncPooledDBConnection:
+    """
+    DB connection from the async pool, same interface as
+    PooledDBConnection with awaitable methods
+    """
+
+    def __init__(self):
+        self.pool = get_async_connection_pool()
+        self.connection = None
+
+    async def __aenter__(self):
+        """context manager Entry"""
+        self.connection = await self.pool.getconn()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """context manager Exit"""
+        if self.connection:
+            await self.pool.putconn(self.connection)
+            self.connection = None
+
+    async def fetch_results(self, sql, params=None):
+        async with self.connection.cursor() as cursor:
+            await cursor.execute(sql, params)
+            return await cursor.fetchall()
+
+    async def fetch_one(self, sql, params=None):
+        async with self.connection.cursor() as cursor:
+            await cursor.execute(sql, params)
+            return await cursor.fetchone()
+
+    async def execute(self, sql, params=None):
+        async with self.connection.cursor() as cursor:
+            await cursor.execute(sql, params)
+
+    async def commit(self):
+        if self.connection:
+            await self.connection.commit()
+
+    async def rollback(self):
+        if self.connection:
+            await self.connection.rollback()
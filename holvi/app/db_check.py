@@ -2,15 +2,26 @@
 Quick & dirty script to check the state on both services
 """
 
+import os
+
 import requests
 
-holvi_payout_count = int(requests.get("http://holvi-api:5002/payout/count").content)
-expenzy_transaction_counts = requests.get("http://expenzy-server:5001/api/transaction/count").json()
+# exact counts by default, REPORT_COUNT_MODE=cached reads Expenzy's
+# maintained counters instead of scanning its table
+count_mode = os.environ.get("REPORT_COUNT_MODE", "exact")
+
+holvi_payout_counts = requests.get("http://holvi-api:5002/payout/count").json()
+holvi_payout_count = holvi_payout_counts["total"]
+expenzy_transaction_counts = requests.get(
+    "http://expenzy-server:5001/api/transaction/count", params={"mode": "cached"} if count_mode == "cached" else None
+).json()
 expenzy_transaction_total_count = expenzy_transaction_counts["total_num_transactions"]
 expenzy_transaction_processing_count = expenzy_transaction_counts["processing_num_transactions"]
 expenzy_max_update_count = expenzy_transaction_counts["max_update_count"]
 
 print("Number of records @ Holvi:  ", holvi_payout_count)
+for status in ("pending", "processing", "completed", "failed"):
+    print(f"  {status}:", holvi_payout_counts[status])
 print("Number of records @ Expenzy:", expenzy_transaction_total_count)
 print("Number of processing records @ Expenzy:", expenzy_transaction_processing_count)
 print("Max amount of updates to single record @ Expenzy:", expenzy_max_update_count)
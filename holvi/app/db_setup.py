@@ -13,6 +13,9 @@ db_connection = DBConnection(
 db_connection.begin_transaction()
 if os.getenv("RESET_DB"):
     db_connection.execute("DROP TABLE IF EXISTS holvi_received_payout;")
+    db_connection.execute("DROP TABLE IF EXISTS holvi_sync_job;")
+    db_connection.execute("DROP TABLE IF EXISTS holvi_sync_cursor;")
+    db_connection.execute("DROP TABLE IF EXISTS holvi_expenzy_outbox;")
 
 db_connection.execute(
     """
@@ -27,13 +30,57 @@ CREATE TABLE IF NOT EXISTS holvi_received_payout(
     processing_started_at timestamptz,
     processing_completed_at timestamptz,
     
+    -- failed Expenzy state updates, see OutboxDispatcher
+    attempt_count integer not null default 0,
+    next_attempt_at timestamptz,
+    last_error text,
+    
     CONSTRAINT unique_expenzy_uuid UNIQUE (expenzy_uuid),
     CONSTRAINT check_processing_status 
-        CHECK (processing_status IN ('pending', 'processing', 'completed'))
+        CHECK (processing_status IN ('pending', 'processing', 'completed', 'failed'))
 );
 """
 )
 
+# Columns added after the table was first released
+db_connection.execute(
+    """
+ALTER TABLE holvi_received_payout
+    ADD COLUMN IF NOT EXISTS attempt_count integer not null default 0,
+    ADD COLUMN IF NOT EXISTS next_attempt_at timestamptz,
+    ADD COLUMN IF NOT EXISTS last_error text;
+"""
+)
+
+# failed: the Expenzy state update can never succeed, see OutboxDispatcher
+db_connection.execute(
+    """
+ALTER TABLE holvi_received_payout
+    DROP CONSTRAINT IF EXISTS check_processing_status,
+    ADD CONSTRAINT check_processing_status
+        CHECK (processing_status IN ('pending', 'processing', 'completed', 'failed'));
+"""
+)
+
+# Payouts claimed before retries were scheduled are due right away
+db_connection.execute(
+    """
+UPDATE holvi_received_payout
+SET next_attempt_at = NOW()
+WHERE next_attempt_at IS NULL
+  AND processing_status IN ('pending', 'processing');
+"""
+)
+
+# Due state updates are fetched by a range scan on this index
+db_connection.execute(
+    """
+CREATE INDEX IF NOT EXISTS idx_next_attempt_at
+ON holvi_received_payout(next_attempt_at)
+WHERE processing_status <> 'completed';
+"""
+)
+
 # Create index for efficient queries on pending payouts
 db_connection.execute(
     """
@@ -43,5 +90,82 @@ WHERE processing_status = 'pending';
 """
 )
 
+# Queue of sync passes for holvi-worker, see job_queue.py
+db_connection.execute(
+    """
+CREATE TABLE IF NOT EXISTS holvi_sync_job(
+    id bigserial primary key,
+    status varchar(20) not null default 'pending',
+    created_at timestamptz not null default NOW(),
+    started_at timestamptz,
+
+    CONSTRAINT check_sync_job_status
+        CHECK (status IN ('pending', 'running'))
+);
+"""
+)
+
+# At most one pending job: webhooks arriving before it is claimed coalesce
+db_connection.execute(
+    """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_sync_job_single_pending
+ON holvi_sync_job((true))
+WHERE status = 'pending';
+"""
+)
+
+# Position in Expenzy's change feed, see PayoutService._load_since
+db_connection.execute(
+    """
+CREATE TABLE IF NOT EXISTS holvi_sync_cursor(
+    name varchar(50) primary key,
+    since text not null,
+    updated_at timestamptz not null
+);
+"""
+)
+
+# Expenzy state updates owed for claimed payouts, written in the claim
+# transaction and drained by OutboxDispatcher
+db_connection.execute(
+    """
+CREATE TABLE IF NOT EXISTS holvi_expenzy_outbox(
+    id bigserial primary key,
+    expenzy_uuid uuid not null,
+    state varchar(20) not null,
+    created_at timestamptz not null default NOW(),
+
+    CONSTRAINT unique_outbox_expenzy_uuid UNIQUE (expenzy_uuid)
+);
+"""
+)
+
+# Payouts claimed before the outbox, or reset to pending by the old stuck
+# payout cleanup, have no outbox entry and nothing would ever send their
+# update. Queue them once; every later claim queues its own entry in the
+# claim transaction, so no new ones appear.
+db_connection.execute(
+    """
+WITH orphans AS (
+    SELECT p.expenzy_uuid
+    FROM holvi_received_payout p
+    WHERE p.processing_status IN ('pending', 'processing')
+      AND NOT EXISTS (
+          SELECT 1 FROM holvi_expenzy_outbox o WHERE o.expenzy_uuid = p.expenzy_uuid
+      )
+), queued AS (
+    INSERT INTO holvi_expenzy_outbox (expenzy_uuid, state)
+    SELECT expenzy_uuid, 'processing' FROM orphans
+    ON CONFLICT (expenzy_uuid) DO NOTHING
+)
+UPDATE holvi_received_payout p
+SET processing_status = 'processing',
+    processing_started_at = NOW(),
+    next_attempt_at = COALESCE(p.next_attempt_at, NOW())
+FROM orphans
+WHERE p.expenzy_uuid = orphans.expenzy_uuid;
+"""
+)
+
 db_connection.commit_transaction()
 db_connection.close()
\ No newline at end of file
@@ -0,0 +1,266 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from circuit_breaker import CircuitBreaker
+from concurrency_limiter import AdaptiveConcurrencyLimiter
+
+
+# error of state updates refused while the circuit breaker is open
+CIRCUIT_OPEN = "Circuit open"
+# error of state updates Expenzy accepted but matched no payout
+NOT_UPDATED = "Not updated"
+
+
+class ExpenzyClient:
+    """
+    HTTP client for the Expenzy API.
+
+    One instance is shared by the whole process (see get_expenzy_client),
+    so all calls reuse the keep-alive connections of a single
+    requests.Session. Pool size, timeouts and the retry policy live here.
+
+    State updates make a single attempt and report why they failed;
+    retrying is scheduled per payout in the database (see OutboxDispatcher)
+    so it survives restarts and never blocks a thread.
+
+    State updates go through a circuit breaker shared by all threads:
+    while Expenzy fails most of them, updates are refused without a
+    request and reported as CIRCUIT_OPEN, to be deferred by the caller.
+    The number of single and of bulk updates in flight are each adapted to
+    Expenzy's latency and 5xx rate by their own AdaptiveConcurrencyLimiter,
+    see metrics().
+    """
+
+    POOL_SIZE = int(os.environ.get("EXPENZY_POOL_SIZE", 20))
+    TIMEOUT = float(os.environ.get("EXPENZY_TIMEOUT", 10))
+    # initial and max in-flight single state updates, the limit adapts in between
+    UPDATE_CONCURRENCY = int(os.environ.get("EXPENZY_UPDATE_CONCURRENCY", 10))
+    UPDATE_CONCURRENCY_MAX = int(os.environ.get("EXPENZY_UPDATE_CONCURRENCY_MAX", POOL_SIZE))
+    # max in-flight bulk updates, one per OutboxDispatcher calling at once,
+    # the limit backs off below that when Expenzy degrades
+    BULK_CONCURRENCY_MAX = int(os.environ.get("EXPENZY_BULK_CONCURRENCY_MAX", 4))
+    # ids per bulk request, Expenzy's MAX_BULK_SIZE
+    BULK_MAX_SIZE = 1000
+    # open the breaker when this share of the last BREAKER_WINDOW updates failed
+    BREAKER_FAILURE_RATE = float(os.environ.get("EXPENZY_BREAKER_FAILURE_RATE", 0.5))
+    BREAKER_WINDOW = int(os.environ.get("EXPENZY_BREAKER_WINDOW", 20))
+    BREAKER_MIN_CALLS = 10
+    BREAKER_COOLDOWN = float(os.environ.get("EXPENZY_BREAKER_COOLDOWN", 10))
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.session = requests.Session()
+        # Transport level: only retry failed connects, the request was
+        # never sent so this is safe for any method.
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.POOL_SIZE,
+            max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.1),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # None until the first bulk update tells whether Expenzy has it
+        self.bulk_supported = None
+        self.update_breaker = CircuitBreaker(
+            "expenzy-update",
+            failure_rate=self.BREAKER_FAILURE_RATE,
+            window=self.BREAKER_WINDOW,
+            min_calls=self.BREAKER_MIN_CALLS,
+            cooldown=self.BREAKER_COOLDOWN,
+        )
+        # separate limits and latency baselines, a bulk call is much slower
+        self.single_limiter = AdaptiveConcurrencyLimiter(
+            self.UPDATE_CONCURRENCY, max_limit=self.UPDATE_CONCURRENCY_MAX,
+        )
+        self.bulk_limiter = AdaptiveConcurrencyLimiter(
+            self.BULK_CONCURRENCY_MAX, max_limit=self.BULK_CONCURRENCY_MAX,
+        )
+        # single updates when bulk is unavailable, threads beyond the
+        # current limit wait in the limiter
+        self._update_executor = ThreadPoolExecutor(
+            max_workers=self.UPDATE_CONCURRENCY_MAX, thread_name_prefix="expenzy-update",
+        )
+
+    def fetch_payout_changes(self, state, since, page_size):
+        """
+        fetch payouts in given state changed after since, using Expenzy's
+        change feed. Yields (payouts, next_since) one page at a time until
+        a page comes back short.
+        Raises: requests.RequestException
+        """
+        params = {"state": state, "since": since, "limit": page_size}
+
+        while True:
+            response = self.session.post(
+                f"{self.base_url}/api/transaction/",
+                params=params,
+                timeout=self.TIMEOUT,
+            )
+            response.raise_for_status()
+            payouts = decode_json(response)
+            next_since = response.headers["X-Next-Since"]
+            yield payouts, next_since
+
+            if len(payouts) < page_size:
+                return
+            params["since"] = next_since
+
+    def update_state(self, payout_id, state):
+        """
+        update state of a payout
+        Return: None if successful, otherwise the error
+        """
+        url = f"{self.base_url}/api/transaction/{payout_id}/"
+
+        if not self.update_breaker.allow_request():
+            return CIRCUIT_OPEN
+        try:
+            response = self._post_update(url, self.single_limiter, data={"state": state})
+        except requests.RequestException as e:
+            return f"Network error: {e}"
+
+        if response.status_code != 200:
+            return f"HTTP {response.status_code}"
+        if not decode_json(response):
+            return NOT_UPDATED
+        return None
+
+    def update_states(self, payout_ids, state):
+        """
+        update state of many payouts, with the bulk endpoint when Expenzy
+        has it and otherwise with concurrent single updates
+        Return: dict of payout id -> None if successful, otherwise the error
+        """
+        if not payout_ids:
+            return {}
+
+        results = {}
+        while payout_ids and self.bulk_supported is not False:
+            chunk, payout_ids = payout_ids[:self.BULK_MAX_SIZE], payout_ids[self.BULK_MAX_SIZE:]
+            chunk_results = self._bulk_update_states(chunk, state)
+            if chunk_results is None:
+                # bulk is not available, the chunk goes through single updates
+                payout_ids = chunk + payout_ids
+                break
+            results.update(chunk_results)
+
+        single_results = self._update_executor.map(lambda payout_id: self.update_state(payout_id, state), payout_ids)
+        results.update(zip(payout_ids, single_results))
+        return results
+
+    def _bulk_update_states(self, payout_ids, state):
+        """
+        update states with POST /api/transaction/bulk/
+        Return: dict of payout id -> None if updated, otherwise the error.
+        None if the endpoint is not available. A rejected request is an
+        error of every id, but not a permanent one: only ids Expenzy
+        reports as not updated are.
+        """
+        url = f"{self.base_url}/api/transaction/bulk/"
+
+        if not self.update_breaker.allow_request():
+            return dict.fromkeys(payout_ids, CIRCUIT_OPEN)
+        try:
+            response = self._post_update(
+                url, self.bulk_limiter, size=len(payout_ids),
+                json={"ids": [str(payout_id) for payout_id in payout_ids], "state": state},
+            )
+        except requests.RequestException as e:
+            return dict.fromkeys(payout_ids, f"Network error: {e}")
+
+        # also when it was there before, e.g. Expenzy was rolled back
+        if response.status_code in (404, 405):
+            print("[ExpenzyClient] Bulk update not available, using single updates")
+            self.bulk_supported = False
+            return None
+
+        if response.status_code != 200:
+            return dict.fromkeys(payout_ids, f"Bulk HTTP {response.status_code}")
+
+        self.bulk_supported = True
+        updated = {result["id"] for result in decode_json(response) if result["updated"]}
+        return {
+            payout_id: None if str(payout_id) in updated else NOT_UPDATED
+            for payout_id in payout_ids
+        }
+
+    def _post_update(self, url, limiter, size=1, **kwargs):
+        """
+        POST a state update of size payouts within the limiter's limit,
+        recording its outcome in the circuit breaker and the limiter.
+        Network errors and 5xx count as failures, any other answer shows
+        Expenzy is up.
+        Raises: requests.RequestException
+        """
+        started_at = limiter.acquire()
+        try:
+            response = self.session.post(url, timeout=self.TIMEOUT, **kwargs)
+        except requests.RequestException:
+            limiter.release(started_at, succeeded=False, size=size)
+            self.update_breaker.record_failure()
+            raise
+
+        succeeded = response.status_code < 500
+        limiter.release(started_at, succeeded=succeeded, size=size)
+        if succeeded:
+            self.update_breaker.record_success()
+        else:
+            self.update_breaker.record_failure()
+        return response
+
+    def metrics(self):
+        """current state of the update breaker and concurrency limits"""
+        return {
+            "update_breaker": self.update_breaker.state,
+            "single_limit": self.single_limiter.limit,
+            "single_in_flight": self.single_limiter.in_flight,
+            "bulk_limit": self.bulk_limiter.limit,
+            "bulk_in_flight": self.bulk_limiter.in_flight,
+        }
+
+    def close(self):
+        self._update_executor.shutdown()
+        self.session.close()
+
+
+def is_permanent_error(error):
+    """
+    True for state update errors retrying cannot fix: Expenzy answered
+    for this very payout that it updated nothing, i.e. it does not know
+    it. Any other error is retried, up to OutboxDispatcher.MAX_ATTEMPTS.
+    """
+    return error == NOT_UPDATED
+
+
+def decode_json(response):
+    """Body of a JSON response, decoded with orjson when installed."""
+    if orjson is None:
+        return response.json()
+    return orjson.loads(response.content)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_expenzy_client():
+    """Get or create the process wide Expenzy client."""
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ExpenzyClient(os.environ.get("EXPENZY_API_BASE_URL", "http://expenzy-server:5001"))
+                print(f"[ExpenzyClient] Created client (pool={ExpenzyClient.POOL_SIZE})")
+
+    return _client
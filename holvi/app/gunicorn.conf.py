@@ -0,0 +1,46 @@
+"""
+gunicorn settings for holvi-api: `gunicorn -c gunicorn.conf.py http_api:app`
+
+By default one uvicorn worker per core, each running its own event loop
+and connection pools. Everything is tunable through the environment:
+
+    GUNICORN_WORKERS        worker processes (default: cpu count, at most
+                            DB_POOL_BUDGET / 2)
+    GUNICORN_WORKER_CLASS   default uvicorn.workers.UvicornWorker
+    GUNICORN_THREADS        threads per worker, only used by gthread
+    DB_POOL_BUDGET          db connections shared by all workers (default 60)
+    DB_POOL_MAX_SIZE        db connections per worker, overrides the budget
+"""
+
+import multiprocessing
+import os
+
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5002")
+# shared-db (max_connections 100, 3 reserved for superusers) also serves
+# holvi-worker (DB_POOL_MAX_SIZE 8 + 1 LISTEN), expenzy-server
+# (GUNICORN_THREADS 4), the producer (1) and one-off scripts such as
+# db_check.py and bench_fetch.py (1 each): at most 97 - 16 = 81 for
+# holvi-api, the budget keeps some headroom below that
+DB_POOL_BUDGET = int(os.environ.get("DB_POOL_BUDGET", 60))
+
+# each worker's pool keeps at least 2 connections open
+workers = int(os.environ.get("GUNICORN_WORKERS", min(multiprocessing.cpu_count(), DB_POOL_BUDGET // 2)))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "uvicorn.workers.UvicornWorker")
+threads = int(os.environ.get("GUNICORN_THREADS", 1))
+# import the app once in the master, workers fork with it loaded
+preload_app = True
+enable_stdio_inheritance = True
+accesslog = None
+errorlog = "-"
+
+# all workers' pools together stay within DB_POOL_BUDGET
+os.environ.setdefault("DB_POOL_MAX_SIZE", str(max(2, DB_POOL_BUDGET // workers)))
+
+
+def post_fork(server, worker):
+    # imported here, connection_pool reads DB_POOL_MAX_SIZE set above
+    from connection_pool import reset_connection_pools
+
+    # each worker opens its own pools, never the master's connections
+    reset_connection_pools()
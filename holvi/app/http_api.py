@@ -1,56 +1,81 @@
 """
 This is the place to implement Holvi's integration!
+
+holvi-api is an ASGI app (Quart, Flask's async twin) on the async
+connection pool, so one process serves many concurrent webhooks on its
+event loop instead of one thread each.
 """
 
+import asyncio
 import os
+import time
 
-from flask import Flask
+from quart import Quart, jsonify
 
-from database import DBConnection
-from payout_service import PayoutService
-from connection_pool import close_connection_pool
-import atexit
+from database_pooled import AsyncPooledDBConnection
+from job_queue import SyncJobQueue
+from connection_pool import open_async_connection_pool, close_async_connection_pool
 
-app = Flask(__name__)
+app = Quart(__name__)
 
 EXPENZY_API_BASE_URL = os.environ.get("EXPENZY_API_BASE_URL", "127.0.0.1")
 
-# Close pool on shutdown
-atexit.register(close_connection_pool)
+# Seconds /payout/count answers are reused for, 0 disables the cache
+PAYOUT_COUNT_CACHE_TTL = float(os.environ.get("PAYOUT_COUNT_CACHE_TTL", 0))
+PAYOUT_STATUSES = ("pending", "processing", "completed", "failed")
+_payout_count_cache = {"expires_at": 0, "counts": None}
+_payout_count_lock = asyncio.Lock()
+
+
+@app.before_serving
+async def open_pool():
+    await open_async_connection_pool()
+
+
+@app.after_serving
+async def close_pool():
+    await close_async_connection_pool()
 
 
 @app.route("/expenzy/webhook/", methods=["GET"])
-def expenzy_webhook():
+async def expenzy_webhook():
     print("Webhook received")
 
-    try:
-        # create service using conn pooling
-        service = PayoutService()
-        service.process_webhook()
-        return "ok"
-    except Exception as e:
-        print(f"Error processing webhook: {e}")
-        return "ok"
+    # the sync pass is run by holvi-worker, webhook only queues it
+    async with AsyncPooledDBConnection() as db:
+        await SyncJobQueue().enqueue_async(db)
+    return "ok"
 
 
 @app.route("/payout/count", methods=["GET"])
-def payout_count():
+async def payout_count():
     """
-    A small helper for db_check.py to fetch amount of recorded payouts.
+    A small helper for db_check.py to fetch amount of recorded payouts,
+    in total and per processing status.
     """
-    (num_payouts,) = create_database_connection().fetch_one("SELECT COUNT(*) FROM holvi_received_payout")
+    async with _payout_count_lock:
+        if time.monotonic() >= _payout_count_cache["expires_at"]:
+            _payout_count_cache["counts"] = await count_payouts()
+            _payout_count_cache["expires_at"] = time.monotonic() + PAYOUT_COUNT_CACHE_TTL
+        counts = _payout_count_cache["counts"]
+
+    return jsonify(counts)
 
-    return str(num_payouts)
 
+async def count_payouts():
+    async with AsyncPooledDBConnection() as db:
+        rows = await db.fetch_results(
+            "SELECT processing_status, COUNT(*) FROM holvi_received_payout GROUP BY processing_status"
+        )
+        await db.commit()
 
-def create_database_connection():
-    return DBConnection(
-        hostname=os.environ.get("DB_HOSTNAME", "127.0.0.1"),
-        username=os.environ.get("DB_USERNAME", "shared"),
-        password=os.environ.get("DB_PASSWORD", "shared"),
-        database=os.environ.get("DB_DATABASE", "shared"),
-    )
+    counts = dict.fromkeys(PAYOUT_STATUSES, 0)
+    counts.update(rows)
+    counts["total"] = sum(count for _, count in rows)
+    return counts
 
 
 if __name__ == "__main__":
-    app.run(debug=True, host="holvi-api", port=5002)
+    import uvicorn
+
+    uvicorn.run(app, host="holvi-api", port=5002)
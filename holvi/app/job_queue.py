@@ -0,0 +1,95 @@
+class SyncJobQueue:
+    """
+    Durable queue of Expenzy sync jobs, stored in holvi_sync_job.
+
+    A job only means "run a sync pass", so the queue holds at most one
+    pending job (enforced by a partial unique index) and enqueueing while
+    one is pending is a no-op. Workers are woken up with NOTIFY on
+    CHANNEL and claim jobs with FOR UPDATE SKIP LOCKED.
+    """
+
+    CHANNEL = "holvi_sync_job"
+    # running jobs older than this belong to a dead worker
+    STALE_AFTER_MINUTES = 5
+
+    ENQUEUE_QUERY = """
+        INSERT INTO holvi_sync_job DEFAULT VALUES
+        ON CONFLICT DO NOTHING
+        RETURNING id
+    """
+
+    def enqueue(self, db):
+        """
+        Queue a sync pass and wake up the workers.
+        Return: True if a new job was queued
+        """
+        try:
+            result = db.fetch_one(self.ENQUEUE_QUERY)
+            if result:
+                db.execute("SELECT pg_notify(%s, %s)", (self.CHANNEL, str(result[0])))
+            db.commit()
+            return bool(result)
+        except Exception as e:
+            print(f"[SyncJobQueue] Error enqueueing: {e}")
+            db.rollback()
+            return False
+
+    async def enqueue_async(self, db):
+        """
+        enqueue with an AsyncPooledDBConnection
+        Return: True if a new job was queued
+        """
+        try:
+            result = await db.fetch_one(self.ENQUEUE_QUERY)
+            if result:
+                await db.execute("SELECT pg_notify(%s, %s)", (self.CHANNEL, str(result[0])))
+            await db.commit()
+            return bool(result)
+        except Exception as e:
+            print(f"[SyncJobQueue] Error enqueueing: {e}")
+            await db.rollback()
+            return False
+
+    def claim(self, db):
+        """
+        Claim the pending job, unless another worker is already running one.
+        Return: id of the claimed job or None
+        """
+        query = """
+            UPDATE holvi_sync_job
+            SET status = 'running',
+                started_at = NOW()
+            WHERE id = (
+                SELECT id FROM holvi_sync_job
+                WHERE status = 'pending'
+                  AND NOT EXISTS (SELECT 1 FROM holvi_sync_job WHERE status = 'running')
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING id
+        """
+        result = db.fetch_one(query)
+        db.commit()
+        return result[0] if result else None
+
+    def complete(self, db, job_id):
+        """remove a finished job"""
+        db.execute("DELETE FROM holvi_sync_job WHERE id = %s", (job_id,))
+        db.commit()
+
+    def requeue_stale(self, db):
+        """
+        Drop running jobs abandoned by a crashed worker and queue a
+        replacement, so their pass is not lost.
+        """
+        query = """
+            DELETE FROM holvi_sync_job
+            WHERE status = 'running'
+              AND started_at < NOW() - make_interval(mins => %s)
+            RETURNING id
+        """
+        results = db.fetch_results(query, (self.STALE_AFTER_MINUTES,))
+        db.commit()
+        if results:
+            print(f"[SyncJobQueue] Requeued {len(results)} stale jobs")
+            self.enqueue(db)
@@ -0,0 +1,218 @@
+import os
+import threading
+import traceback
+
+from database_pooled import PooledDBConnection
+from expenzy_client import CIRCUIT_OPEN, get_expenzy_client, is_permanent_error
+
+
+class OutboxDispatcher:
+    """
+    Sends the Expenzy state updates queued in holvi_expenzy_outbox.
+
+    PayoutService queues an update in the same transaction that claims a
+    payout, so a claimed payout always has its update queued, whatever
+    happens to the process afterwards. The dispatcher drains the outbox
+    in batches. A batch is claimed with FOR UPDATE SKIP LOCKED in a short
+    transaction that leases it, pushing next_attempt_at LEASE_SECONDS
+    ahead, so any number of dispatcher threads and workers can run side
+    by side and no transaction stays open during the Expenzy calls. If
+    the dispatcher dies, the lease runs out and the batch is due again.
+    The results are recorded in a second short transaction: sent entries
+    are deleted and their payouts marked completed. Failed ones stay in
+    the outbox, and their payout goes back to pending with an exponential
+    backoff (attempt_count, next_attempt_at, last_error) before the next
+    try. Failures retrying cannot fix, and payouts out of their
+    MAX_ATTEMPTS, are marked failed and leave the outbox. Updates refused
+    by the client's open circuit breaker were never sent: their payouts
+    are deferred until the breaker lets calls through again, without
+    counting an attempt.
+    """
+
+    CHANNEL = "holvi_expenzy_outbox"
+    BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 100))
+    # seconds between rounds when the outbox is empty or only has failures
+    INTERVAL = float(os.environ.get("OUTBOX_DISPATCH_INTERVAL", 1))
+    # retry delay is BACKOFF_BASE * 2 ** attempts, capped at BACKOFF_MAX
+    BACKOFF_BASE_SECONDS = 1
+    BACKOFF_MAX_SECONDS = 300
+    # payouts still failing after this many attempts are given up
+    MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 20))
+    # claimed batches are due again after this, should outlast a batch
+    LEASE_SECONDS = int(os.environ.get("OUTBOX_LEASE_SECONDS", 120))
+
+    def __init__(self, name="OutboxDispatcher"):
+        self.name = name
+        self.expenzy = get_expenzy_client()
+        self._wake_up = threading.Event()
+
+    @classmethod
+    def notify(cls, db):
+        """Wake up dispatchers once the current transaction commits."""
+        db.execute("SELECT pg_notify(%s, '')", (cls.CHANNEL,))
+
+    def wake_up(self):
+        self._wake_up.set()
+
+    def run(self):
+        """Dispatch forever, call from a dedicated thread."""
+        print(f"[{self.name}] started")
+        while True:
+            self._wake_up.clear()
+            try:
+                dispatched = self.dispatch_batch()
+            except Exception as exc:
+                print(f"[{self.name}] dispatch failed: {exc}")
+                traceback.print_exception(exc)
+                dispatched = 0
+
+            if dispatched < self.BATCH_SIZE:
+                self._wake_up.wait(self.INTERVAL)
+
+    def dispatch_batch(self):
+        """
+        send one batch of queued state updates
+        Return: count of successful
+        """
+        entries = self._lease_batch()
+        if not entries:
+            return 0
+
+        by_state = {}
+        for entry_id, expenzy_uuid, state in entries:
+            by_state.setdefault(state, []).append((entry_id, expenzy_uuid))
+
+        # no transaction is open while calling Expenzy
+        sent_entry_ids = []
+        sent_payout_ids = []
+        errors = {}
+        deferred_payout_ids = []
+        for state, state_entries in by_state.items():
+            results = self.expenzy.update_states([expenzy_uuid for _, expenzy_uuid in state_entries], state)
+            for entry_id, expenzy_uuid in state_entries:
+                if results[expenzy_uuid] is None:
+                    sent_entry_ids.append(entry_id)
+                    sent_payout_ids.append(expenzy_uuid)
+                elif results[expenzy_uuid] == CIRCUIT_OPEN:
+                    deferred_payout_ids.append(expenzy_uuid)
+                else:
+                    errors[expenzy_uuid] = results[expenzy_uuid]
+
+        with PooledDBConnection() as db:
+            try:
+                db.execute("DELETE FROM holvi_expenzy_outbox WHERE id = ANY(%s)", (sent_entry_ids,))
+                self._mark_completed(db, sent_payout_ids)
+                self._schedule_retry(db, errors)
+                self._defer(db, deferred_payout_ids)
+                db.commit()
+            except Exception as e:
+                # the batch is sent again once its lease runs out
+                print(f"[{self.name}] Error recording sent updates: {e}")
+                db.rollback()
+                return 0
+
+        if deferred_payout_ids:
+            print(f"[{self.name}] Circuit open, deferred {len(deferred_payout_ids)} state updates")
+        metrics = self.expenzy.metrics()
+        print(f"[{self.name}] Sent {len(sent_entry_ids)}/{len(entries)} state updates "
+              f"(bulk limit {metrics['bulk_limit']}, single limit {metrics['single_limit']}, "
+              f"breaker {metrics['update_breaker']})")
+        return len(sent_entry_ids)
+
+    def _lease_batch(self):
+        """
+        claim up to BATCH_SIZE due outbox entries for LEASE_SECONDS
+        Return: list of (entry id, expenzy_uuid, state)
+        """
+        # due payouts come from a range scan of idx_next_attempt_at
+        query = """
+            WITH due AS (
+                SELECT o.id, o.expenzy_uuid, o.state
+                FROM holvi_received_payout p
+                JOIN holvi_expenzy_outbox o ON o.expenzy_uuid = p.expenzy_uuid
+                WHERE p.processing_status <> 'completed'
+                  AND p.next_attempt_at <= NOW()
+                ORDER BY p.next_attempt_at
+                FOR UPDATE OF o, p SKIP LOCKED
+                LIMIT %s
+            )
+            UPDATE holvi_received_payout p
+            SET next_attempt_at = NOW() + make_interval(secs => %s)
+            FROM due
+            WHERE p.expenzy_uuid = due.expenzy_uuid
+            RETURNING due.id, due.expenzy_uuid, due.state
+        """
+
+        with PooledDBConnection() as db:
+            try:
+                entries = db.fetch_results(query, (self.BATCH_SIZE, self.LEASE_SECONDS))
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+        return entries
+
+    def _mark_completed(self, db, payout_ids):
+        """mark payouts as completed in db, one UPDATE for the batch"""
+        query = """
+            UPDATE holvi_received_payout
+            SET processing_status = 'completed',
+                processing_completed_at = NOW()
+            WHERE expenzy_uuid = ANY(%s::uuid[])
+        """
+        db.execute(query, (payout_ids,))
+
+    def _schedule_retry(self, db, errors):
+        """
+        back off failed payouts, exponentially in their attempt count,
+        recording why they failed. Permanent failures and payouts out of
+        attempts are marked failed instead, and their outbox entry dropped.
+        """
+        query = """
+            WITH updated AS (
+                UPDATE holvi_received_payout p
+                SET processing_status = CASE WHEN f.permanent OR p.attempt_count + 1 >= %(max_attempts)s
+                                             THEN 'failed' ELSE 'pending' END,
+                    attempt_count = p.attempt_count + 1,
+                    next_attempt_at = CASE WHEN f.permanent OR p.attempt_count + 1 >= %(max_attempts)s
+                                           THEN NULL
+                                           ELSE NOW() + make_interval(
+                                               secs => LEAST(%(max)s, %(base)s * power(2, LEAST(p.attempt_count, 20)))
+                                                       * (0.8 + random() * 0.4)
+                                           ) END,
+                    last_error = f.error
+                FROM unnest(%(ids)s::uuid[], %(errors)s::text[], %(permanent)s::boolean[])
+                     AS f(expenzy_uuid, error, permanent)
+                WHERE p.expenzy_uuid = f.expenzy_uuid
+                RETURNING p.expenzy_uuid, p.processing_status
+            )
+            DELETE FROM holvi_expenzy_outbox o
+            USING updated
+            WHERE o.expenzy_uuid = updated.expenzy_uuid
+              AND updated.processing_status = 'failed'
+            RETURNING o.expenzy_uuid
+        """
+        failed = db.fetch_results(query, {
+            "max_attempts": self.MAX_ATTEMPTS,
+            "max": self.BACKOFF_MAX_SECONDS,
+            "base": self.BACKOFF_BASE_SECONDS,
+            "ids": list(errors),
+            "errors": list(errors.values()),
+            "permanent": [is_permanent_error(error) for error in errors.values()],
+        })
+        if failed:
+            print(f"[{self.name}] Gave up on {len(failed)} state updates")
+
+    def _defer(self, db, payout_ids):
+        """
+        push back payouts whose update was refused by the open circuit
+        breaker until it lets calls through, attempt_count is kept
+        """
+        query = """
+            UPDATE holvi_received_payout
+            SET processing_status = 'pending',
+                next_attempt_at = NOW() + make_interval(secs => %s)
+            WHERE expenzy_uuid = ANY(%s::uuid[])
+        """
+        retry_after = max(self.expenzy.update_breaker.retry_after(), self.INTERVAL)
+        db.execute(query, (retry_after, payout_ids))
@@ -1,7 +1,7 @@
-import os
 import requests
-import time
 from database_pooled import PooledDBConnection
+from expenzy_client import get_expenzy_client
+from outbox_dispatcher import OutboxDispatcher
 
 
 class PayoutService:
@@ -10,20 +10,20 @@ class PayoutService:
     
     Optimizations:
     - Conn pooling
+    - Shared keep-alive HTTP client
     - Batch pprocessing
-    - Limited fetching
+    - Incremental fetching from Expenzy's change feed
+    - State updates queued in an outbox, sent by OutboxDispatcher
     """
     
     # Config
-    FETCH_LIMIT = 200
+    # payouts per Expenzy page, each page is claimed as a batch
     BATCH_SIZE = 50  
-    MAX_RETRIES = 3   
+    # holvi_sync_cursor row holding our position in the change feed
+    SYNC_CURSOR = "expenzy_payout"
     
     def __init__(self):
-        self.expenzy_base_url = os.environ.get(
-            "EXPENZY_API_BASE_URL", 
-            "http://expenzy-server:5001"
-        )
+        self.expenzy = get_expenzy_client()
     
     def process_webhook(self):
         """
@@ -33,212 +33,137 @@ class PayoutService:
         print("[PayoutService] starting webhook processing")
         
         with PooledDBConnection() as db:
-            # 0. clean stucked payouts
-            self._cleanup_stuck_payouts(db, timeout_minutes=5)
-            
-            # 1. fetch limited payouts from expany
-            payouts = self._fetch_payouts_from_expenzy(limit=self.FETCH_LIMIT)
-            print(f"[PayoutService] Fetched {len(payouts)} payouts from Expenzy")
-            
-            if not payouts:
-                print("[PayoutService] No payouts to process")
-                return
-            
-            # 2. Process in batches
+            # 1. page through payouts changed since last pass, 2. claim each page as a batch
+            total_fetched = 0
             total_claimed = 0
-            total_processed = 0
             
-            for i in range(0, len(payouts), self.BATCH_SIZE):
-                batch = payouts[i:i + self.BATCH_SIZE]
+            since = self._load_since(db)
+            for page_number, (batch, next_since) in enumerate(self._fetch_payout_pages(since), start=1):
+                total_fetched += len(batch)
                 
                 claimed = self._claim_batch(db, batch)
+                if claimed is None:
+                    # page not stored, keep the cursor so it is fetched again
+                    break
                 total_claimed += len(claimed)
+                # page is safely stored in our db, never fetch it again
+                self._save_since(db, next_since)
                 
-                processed = self._process_batch(db, claimed)
-                total_processed += processed
-                
-                print(f"[PayoutService] Batch {i//self.BATCH_SIZE + 1}: "
-                      f"Claimed {len(claimed)}/{len(batch)}, "
-                      f"Processed {processed}/{len(claimed)}")
+                print(f"[PayoutService] Batch {page_number}: "
+                      f"Claimed {len(claimed)}/{len(batch)}")
             
-            print(f"[PayoutService] Claimed {total_claimed}, "
-                  f"Processed {total_processed}")
+            if not total_fetched:
+                print("[PayoutService] No payouts to process")
+                return
+            
+            print(f"[PayoutService] Fetched {total_fetched}, "
+                  f"Claimed {total_claimed}")
             print("[PayoutService] processing complete")
     
-    def _fetch_payouts_from_expenzy(self, limit=None):
+    def _fetch_payout_pages(self, since):
         """
-        fetch with optional limit
+        fetch notifying payouts changed since the given cursor, page by page
         """
         try:
-            url = f"{self.expenzy_base_url}/api/transaction/"
-            params = {"state": "notifying"}
-            
-            response = requests.post(url, params=params, timeout=10)
-            response.raise_for_status()
-            
-            payouts = response.json()
-            
-            # limit (if specified)
-            if limit and len(payouts) > limit:
-                print(f"[PayoutService] limiting to {limit} payouts "
-                      f"(total available: {len(payouts)})")
-                payouts = payouts[:limit]
-            
-            return payouts
-            
+            yield from self.expenzy.fetch_payout_changes(
+                state="notifying", since=since, page_size=self.BATCH_SIZE
+            )
         except requests.RequestException as e:
             print(f"[PayoutService] Error fetching: {e}")
-            return []
     
-    def _claim_batch(self, db, batch):
-        """
-        claim batch atomically
-        Returns: list of claimed payouts
-        """
-        claimed = []
-        
-        for payout in batch:
-            # Validation
-            required_fields = ['id', 'create_time', 'amount', 
-                             'recipient_account_identifier']
-            if not all(field in payout for field in required_fields):
-                print(f"[PayoutService] invalid data, skipping")
-                continue
-            
-            if self._try_claim_payout(db, payout):
-                claimed.append(payout)
-        
-        return claimed
-    
-    def _try_claim_payout(self, db, payout):
-        """
-        claim single atomically
-        Return: True (if claimed)
-        """
-        query = """
-            INSERT INTO holvi_received_payout (
-                expenzy_uuid,
-                create_time,
-                amount,
-                recipient_account_identifier,
-                processing_status,
-                processing_started_at
-            ) VALUES (%s, %s, %s, %s, 'processing', NOW())
-            ON CONFLICT (expenzy_uuid) DO NOTHING
-            RETURNING id
-        """
-        
-        try:
-            result = db.fetch_one(query, (
-                payout['id'],
-                payout['create_time'],
-                payout['amount'],
-                payout['recipient_account_identifier']
-            ))
-            
-            if result:
-                return True
-            else:
-                return False
-                
-        except Exception as e:
-            print(f"[PayoutService] Error claiming: {e}")
-            return False
-    
-    def _process_batch(self, db, claimed_payouts):
-        """
-        process batch of claimed payouts
-        Return: count of successful
-        """
-        success_count = 0
-        
-        for payout in claimed_payouts:
-            if self._process_payout(db, payout):
-                success_count += 1
-        
-        return success_count
-    
-    def _process_payout(self, db, payout):
-        """
-        process single claimed payout
-        Return: True (if successful)
-        """
-        payout_id = payout['id']
-        
-        # update expenzy state with retry
-        success = self._update_expenzy_state(payout_id)
-        
-        if success:
-            self._mark_completed(db, payout_id)
-            return True
-        else:
-            print(f"[PayoutService] Fail to process {payout_id}")
-            return False
+    def _load_since(self, db):
+        """position in Expenzy's change feed, "0" for the beginning"""
+        result = db.fetch_one(
+            "SELECT since FROM holvi_sync_cursor WHERE name = %s",
+            (self.SYNC_CURSOR,)
+        )
+        db.commit()
+        return result[0] if result else "0"
     
-    def _update_expenzy_state(self, payout_id):
+    def _save_since(self, db, since):
         """
-        update state in expenzy with retry
-        Return: True if successful
+        Store position in the change feed. Concurrent passes may move it
+        back a little, which only causes a refetch: claims are idempotent.
         """
-        backoff_seconds = [1, 2, 4]
-        
-        for attempt in range(self.MAX_RETRIES):
-            try:
-                url = f"{self.expenzy_base_url}/api/transaction/{payout_id}/"
-                data = {"state": "processing"}
-                
-                response = requests.post(url, data=data, timeout=10)
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    if result:
-                        return True
-                
-            except requests.RequestException as e:
-                print(f"[PayoutService] Network error: {e}")
-
-            if attempt < self.MAX_RETRIES - 1:
-                time.sleep(backoff_seconds[attempt])
-        
-        return False
-    
-    def _mark_completed(self, db, payout_id):
-        """mark payout as completed in db"""
         query = """
-            UPDATE holvi_received_payout
-            SET processing_status = 'completed',
-                processing_completed_at = NOW()
-            WHERE expenzy_uuid = %s
+            INSERT INTO holvi_sync_cursor (name, since, updated_at)
+            VALUES (%s, %s, NOW())
+            ON CONFLICT (name) DO UPDATE
+            SET since = EXCLUDED.since,
+                updated_at = EXCLUDED.updated_at
         """
         
         try:
-            db.execute(query, (payout_id,))
+            db.execute(query, (self.SYNC_CURSOR, since))
             db.commit()
         except Exception as e:
-            print(f"[PayoutService] Error marking completed: {e}")
+            print(f"[PayoutService] Error saving sync cursor: {e}")
             db.rollback()
     
-    def _cleanup_stuck_payouts(self, db, timeout_minutes=5):
+    def _claim_batch(self, db, batch):
         """
-        Reset payouts stuck in processing.
+        claim batch atomically, with a single multi-row INSERT. The
+        Expenzy state update of each claimed payout is queued in the
+        outbox in the same transaction.
+        Returns: list of claimed payouts, None if the batch could not be stored
         """
+        required_fields = ['id', 'create_time', 'amount',
+                           'recipient_account_identifier']
+        valid = []
+        for payout in batch:
+            # Validation
+            if not all(field in payout for field in required_fields):
+                print(f"[PayoutService] invalid data, skipping")
+                continue
+            valid.append(payout)
+
+        if not valid:
+            return []
+
         query = """
-            UPDATE holvi_received_payout
-            SET processing_status = 'pending',
-                processing_started_at = NULL
-            WHERE processing_status = 'processing'
-              AND processing_started_at < NOW() - INTERVAL '%s minutes'
-            RETURNING expenzy_uuid
+            WITH claimed AS (
+                INSERT INTO holvi_received_payout (
+                    expenzy_uuid,
+                    create_time,
+                    amount,
+                    recipient_account_identifier,
+                    processing_status,
+                    processing_started_at,
+                    next_attempt_at
+                )
+                SELECT expenzy_uuid, create_time, amount, recipient_account_identifier,
+                       'processing', NOW(), NOW()
+                FROM unnest(%s::uuid[], %s::timestamptz[], %s::numeric[], %s::varchar[])
+                    AS batch(expenzy_uuid, create_time, amount, recipient_account_identifier)
+                ON CONFLICT (expenzy_uuid) DO NOTHING
+                RETURNING expenzy_uuid
+            ), queued AS (
+                INSERT INTO holvi_expenzy_outbox (expenzy_uuid, state)
+                SELECT expenzy_uuid, 'processing' FROM claimed
+            )
+            SELECT expenzy_uuid FROM claimed
         """
-        
+
         try:
-            query_formatted = query % timeout_minutes
-            results = db.fetch_results(query_formatted)
-            
+            results = db.fetch_results(query, (
+                [payout['id'] for payout in valid],
+                [payout['create_time'] for payout in valid],
+                [payout['amount'] for payout in valid],
+                [payout['recipient_account_identifier'] for payout in valid],
+            ))
             if results:
-                db.commit()
-                print(f"[PayoutService] Reset {len(results)} stuck payouts")
-            
+                OutboxDispatcher.notify(db)
+            db.commit()
         except Exception as e:
-            print(f"[PayoutService] Error in cleanup: {e}")
-            db.rollback()
\ No newline at end of file
+            print(f"[PayoutService] Error claiming: {e}")
+            db.rollback()
+            return None
+
+        # RETURNING only lists rows this statement inserted
+        claimed_ids = {str(expenzy_uuid) for (expenzy_uuid,) in results}
+        claimed = []
+        for payout in valid:
+            if str(payout['id']) in claimed_ids:
+                claimed_ids.discard(str(payout['id']))
+                claimed.append(payout)
+        return claimed
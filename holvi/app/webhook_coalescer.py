@@ -0,0 +1,45 @@
+import threading
+import traceback
+
+
+class WebhookCoalescer:
+    """
+    Collapses webhook notifications into sync passes.
+
+    Webhooks carry no data, they only say "something changed", so any
+    number of them arriving while a pass is running can be served by a
+    single follow-up pass. notify() only flags pending work and returns;
+    one background thread runs the sync function whenever the flag is set.
+    """
+
+    def __init__(self, sync, name="WebhookCoalescer"):
+        self.sync = sync
+        self.name = name
+        self._pending = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def notify(self):
+        """Mark work pending, starting the sync loop on first use."""
+        self._pending.set()
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+                print(f"[{self.name}] started sync loop")
+
+    def _run(self):
+        while True:
+            self._pending.wait()
+            # Clear before the pass: webhooks arriving during the pass set
+            # the flag again and are served by exactly one more pass.
+            self._pending.clear()
+            try:
+                self.sync()
+            except Exception as exc:
+                print(f"[{self.name}] sync pass failed: {exc}")
+                traceback.print_exception(exc)
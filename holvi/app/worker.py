@@ -0,0 +1,113 @@
+"""
+Holvi worker: runs the Expenzy sync passes outside the request path.
+
+Webhooks only enqueue a job in holvi_sync_job (see job_queue.py). The
+worker LISTENs for the queue's NOTIFY. Every WORKER_POLL_INTERVAL
+seconds without one it queues a sync pass itself, so payouts whose
+webhook was lost or failed to enqueue are still picked up; with the
+change feed a pass finding nothing new costs one Expenzy call. Several
+workers can run side by side, jobs are claimed with SKIP LOCKED.
+
+The Expenzy state updates queued by the passes are sent by
+OUTBOX_DISPATCHERS OutboxDispatcher threads, woken up by their own NOTIFY.
+"""
+
+import os
+import select
+import threading
+import time
+import traceback
+
+import psycopg
+
+from connection_pool import get_connection_pool, get_conninfo, close_connection_pool
+from database_pooled import PooledDBConnection
+from job_queue import SyncJobQueue
+from outbox_dispatcher import OutboxDispatcher
+from payout_service import PayoutService
+from webhook_coalescer import WebhookCoalescer
+
+
+POLL_INTERVAL = float(os.environ.get("WORKER_POLL_INTERVAL", 5))
+OUTBOX_DISPATCHERS = int(os.environ.get("OUTBOX_DISPATCHERS", 2))
+RECONNECT_DELAY = 1
+
+
+def drain_jobs(queue):
+    """Run a sync pass for each claimable job until the queue is empty."""
+    while True:
+        with PooledDBConnection() as db:
+            queue.requeue_stale(db)
+            job_id = queue.claim(db)
+        if job_id is None:
+            return
+
+        print(f"[Worker] Running job {job_id}")
+        try:
+            PayoutService().process_webhook()
+        except Exception:
+            with PooledDBConnection() as db:
+                queue.complete(db, job_id)
+                queue.enqueue(db)  # retried on the next wake-up
+            raise
+        with PooledDBConnection() as db:
+            queue.complete(db, job_id)
+
+
+def poll(queue, coalescer):
+    """Queue a sync pass without waiting for a webhook, and run it."""
+    with PooledDBConnection() as db:
+        queue.enqueue(db)
+    coalescer.notify()
+
+
+def listen(queue, coalescer, dispatchers):
+    """
+    Wake the coalescer on each sync job NOTIFY, poll every POLL_INTERVAL
+    seconds without one, and wake the dispatchers on each outbox NOTIFY.
+    """
+
+    def on_notify(notify):
+        if notify.channel == OutboxDispatcher.CHANNEL:
+            for dispatcher in dispatchers:
+                dispatcher.wake_up()
+        else:
+            coalescer.notify()
+
+    with psycopg.connect(get_conninfo(), autocommit=True) as connection:
+        connection.add_notify_handler(on_notify)
+        connection.execute(f"LISTEN {queue.CHANNEL}")
+        connection.execute(f"LISTEN {OutboxDispatcher.CHANNEL}")
+        print(f"[Worker] Listening on {queue.CHANNEL}, {OutboxDispatcher.CHANNEL}")
+
+        # webhooks may have come while nobody was listening
+        poll(queue, coalescer)
+        while True:
+            readable, _, _ = select.select([connection], [], [], POLL_INTERVAL)
+            if readable:
+                # reading the results delivers pending notifies to the handler
+                connection.execute("SELECT 1")
+            else:
+                poll(queue, coalescer)
+
+
+def main():
+    get_connection_pool()
+    queue = SyncJobQueue()
+    coalescer = WebhookCoalescer(lambda: drain_jobs(queue), name="Worker")
+    dispatchers = [OutboxDispatcher(name=f"OutboxDispatcher-{i}") for i in range(OUTBOX_DISPATCHERS)]
+    for dispatcher in dispatchers:
+        threading.Thread(target=dispatcher.run, name=dispatcher.name, daemon=True).start()
+    try:
+        while True:
+            try:
+                listen(queue, coalescer, dispatchers)
+            except psycopg.Error as exc:
+                traceback.print_exception(exc)
+                time.sleep(RECONNECT_DELAY)
+    finally:
+        close_connection_pool()
+
+
+if __name__ == "__main__":
+    main()